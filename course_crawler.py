@@ -5,28 +5,97 @@
 定期爬取各學制的課程資料並儲存為JSON格式
 """
 
+import contextlib
 import json
 import os
 import logging
 import re
-from typing import Dict, Optional, Any
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Any
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+try:
+    import orjson
+except ImportError:  # 未安裝 orjson 時退回標準函式庫
+    orjson = None
+
+
+def _loads(text: Any) -> Any:
+    """解析 JSON，優先使用 orjson（其 JSONDecodeError 為 json.JSONDecodeError 子類別）"""
+    if orjson is None:
+        return json.loads(text)
+    return orjson.loads(text)
+
+
+def _dumps(data: Any, pretty: bool = False) -> bytes:
+    """序列化為 UTF-8 JSON 位元組，預設輸出不縮排的精簡格式"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else None)
+    if pretty:
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+    else:
+        text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return text.encode("utf-8")
+
+
+# 清理與修補皆直接處理 UTF-8 位元組，不先解碼成 str
+# \t \r \n 換成空白，其餘 C0 控制字元與 DEL 刪除（bytes.translate 單次完成）
+_WS_TABLE = bytes.maketrans(b"\t\r\n", b"   ")
+_CTRL_DELETE = (
+    bytes(range(0x00, 0x09)) + b"\x0b\x0c" + bytes(range(0x0E, 0x20)) + b"\x7f"
+)
+# C1 控制字元 (U+0080-U+009F) 在 UTF-8 中為 \xc2\x80-\xc2\x9f，
+# 不能直接刪除 0x80-0x9f 位元組，否則會破壞中文等多位元組字元
+_RE_C1 = re.compile(rb"\xc2[\x80-\x9f]")
+
+# 修補破損 JSON 的所有規則合併為單一正規表示式，一次掃描完成：
+#   (A) 開頭多餘逗號          -> 刪除
+#   (B) 陣列開頭多逗號        -> "["
+#   (E) 尾逗號                -> 刪除
+#   (C) 連續逗號              -> ","
+#   (D) 冒號後缺值            -> ": null"
+_RE_REPAIR = re.compile(
+    rb"\A\s*,[\s,]*"
+    rb"|(\[)\s*,[\s,]*"
+    rb"|,[\s,]*(?=[\]}])"
+    rb"|(,)(?:\s*,)+"
+    rb"|(:)\s*(?=[,\]}])"
+)
+
+
+def _repair_match(match: "re.Match[bytes]") -> bytes:
+    """_RE_REPAIR 的替換：依命中的規則回傳對應內容"""
+    if match.group(3):
+        return b": null"
+    return match.group(1) or match.group(2) or b""
+
+
+# fetch_course_data(load_cached=False) 在伺服器回應 304（資料未變更）時回傳的標記，
+# 以 `is` 比對；刻意不是 dict，避免被當成課程資料存檔
+NOT_MODIFIED: Any = object()
 
 
 class NCHUCourseCrawler:
     """中興大學課程爬蟲"""
 
-    def __init__(self, data_dir: str = "course-helper-web/public/data"):
+    def __init__(
+        self, data_dir: str = "course-helper-web/public/data", pretty: bool = False
+    ):
         """
         初始化爬取器
 
         Args:
             data_dir: 資料儲存目錄
+            pretty: 是否以縮排格式輸出 JSON（除錯用）
         """
         # 對中興大學課程 API 依學制（課程種類）逐一發送 GET 請求
         self.base_url = "https://onepiece.nchu.edu.tw/cofsys/plsql/json_for_course"
         self.data_dir = data_dir
+        self.pretty = pretty
         self.career_mapping = {
             "U": "學士班",
             "O": "通識加體育課",
@@ -36,6 +105,33 @@ class NCHUCourseCrawler:
             "D": "博士班",
         }
 
+        # 共用連線池，讓各學制請求重用 keep-alive 連線；
+        # 暫時性錯誤（含 429）以指數退避重試，並遵守 Retry-After
+        pool_size = len(self.career_mapping)
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            respect_retry_after_header=True,
+        )
+        self.session = requests.Session()
+        self.session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+            ),
+        )
+
+        # 各請求之間至少間隔 request_interval 秒（約每秒 4 次），避免瞬間湧入；
+        # 伺服器真的忙碌時由 Retry 依 Retry-After 退避
+        self.request_interval = 0.25
+        self._next_request_at = 0.0
+        self._throttle_lock = threading.Lock()
+
+        # 本次下載回應的 ETag / Last-Modified，存檔成功後才寫入 {career}.meta.json
+        self._pending_validators: Dict[str, Dict[str, str]] = {}
+
         # 設定日誌
         self._setup_logging()
 
@@ -55,51 +151,65 @@ class NCHUCourseCrawler:
         )
         self.logger = logging.getLogger(__name__)
 
-    def _clean_json_text(self, text: str) -> str:
-        # 先把常見空白控制字元換空白
-        text = re.sub(r"[\t\r\n]+", " ", text)
-
-        # 移除其他控制字元
-        cleaned = re.sub(r"[\x00-\x08\x0b-\x1f\x7f-\x9f]", "", text)
+    def _throttle(self) -> None:
+        """預約下一個可送出請求的時間點，必要時等待到該時間"""
+        with self._throttle_lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_request_at)
+            self._next_request_at = start_at + self.request_interval
+        if start_at > now:
+            time.sleep(start_at - now)
 
-        # 找 JSON 起點：'[' 或 '{'
-        first_obj = cleaned.find("{")
-        first_arr = cleaned.find("[")
-        starts = [i for i in [first_obj, first_arr] if i != -1]
-        if starts:
-            cleaned = cleaned[min(starts) :]
+    def _data_path(self, career: str, career_name: str) -> str:
+        """學制課程資料檔路徑（固定檔名，不含時間戳記）"""
+        return os.path.join(self.data_dir, f"{career}_{career_name}.json")
 
-        # 找 JSON 終點：']' 或 '}'
-        last_obj = cleaned.rfind("}")
-        last_arr = cleaned.rfind("]")
-        end = max(last_obj, last_arr)
-        if end != -1:
-            cleaned = cleaned[: end + 1]
+    def _meta_path(self, career: str) -> str:
+        """記錄 ETag / Last-Modified 的附屬檔路徑"""
+        return os.path.join(self.data_dir, f"{career}.meta.json")
 
-        return cleaned
-
-    def _repair_common_corruption(self, text: str) -> str:
-        repaired = text
-
-        # (A) 開頭多餘逗號
-        repaired = re.sub(r"^\s*,+\s*", "", repaired)
-
-        # (B) 陣列開頭多逗號
-        repaired = re.sub(r"\[\s*,+\s*", "[", repaired)
-
-        # (C) 連續逗號
-        repaired = re.sub(r",\s*,+", ",", repaired)
-
-        # (D) 冒號後缺值 -> null
-        repaired = re.sub(r":\s*(?=,|\}|\])", ": null", repaired)
-
-        # (E) 尾逗號（可選，常見）
-        repaired = re.sub(r",\s*]", "]", repaired)
-        repaired = re.sub(r",\s*}", "}", repaired)
+    def _conditional_headers(self, career: str, career_name: str) -> Dict[str, str]:
+        """
+        依上次存檔時的 ETag / Last-Modified 產生條件式請求標頭
 
-        return repaired
+        資料檔不存在或附屬檔無法讀取時回傳空字典，改為完整下載
+        """
+        if not os.path.exists(self._data_path(career, career_name)):
+            return {}
 
-    def _save_raw_response(self, career: str, content: str, status: str) -> None:
+        try:
+            with open(self._meta_path(career), "rb") as f:
+                meta = _loads(f.read())
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(meta, dict):
+            return {}
+
+        headers: Dict[str, str] = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def _clean_json_text(self, text: bytes) -> bytes:
+        # 找 JSON 起點 '[' / '{' 與終點 ']' / '}'，只切片一次；
+        # 控制字元不影響括號位置，先裁切可讓後續清理只處理 JSON 主體
+        starts = [i for i in (text.find(b"{"), text.find(b"[")) if i != -1]
+        start = min(starts) if starts else 0
+        end = max(text.rfind(b"}", start), text.rfind(b"]", start))
+        if end == -1:
+            end = len(text) - 1
+        text = text[start : end + 1]
+
+        # 常見空白控制字元換空白、移除其他控制字元
+        return _RE_C1.sub(b"", text.translate(_WS_TABLE, _CTRL_DELETE))
+
+    def _repair_common_corruption(self, text: bytes) -> bytes:
+        # (A)-(E) 各規則見 _RE_REPAIR，單次掃描完成
+        return _RE_REPAIR.sub(_repair_match, text)
+
+    def _save_raw_response(self, career: str, content: bytes, status: str) -> None:
         """
         保存原始回應內容用於調試
 
@@ -113,108 +223,227 @@ class NCHUCourseCrawler:
         filepath = os.path.join(self.data_dir, filename)
 
         try:
-            with open(filepath, "w", encoding="utf-8") as file:
+            # 原樣寫入位元組，保留伺服器回應的原始編碼
+            with open(filepath, "wb") as file:
                 file.write(content)
             self.logger.info("原始回應已保存至: %s", filepath)
-        except (OSError, UnicodeError) as exc:
-            # OSError: 路徑/權限/磁碟問題；UnicodeError: 編碼寫入問題
+        except OSError as exc:
+            # OSError: 路徑/權限/磁碟問題
             self.logger.error("保存原始回應失敗: %s", exc)
 
-    def fetch_course_data(self, career: str) -> Optional[Dict[str, Any]]:
+    def fetch_course_data(
+        self, career: str, career_name: str, load_cached: bool = True
+    ) -> Optional[Dict[str, Any]]:
         """
         爬取指定學制的課程資料
 
         Args:
             career: 學制代碼 (U, O, N, W, G, D)
+            career_name: 學制名稱（用於日誌）
+            load_cached: 資料未變更時是否讀回上次儲存的資料；
+                為 False 時改回傳 NOT_MODIFIED，略過讀檔
 
         Returns:
-            課程資料字典，失敗時回傳 None
+            課程資料字典；資料未變更且 load_cached 為 False 時回傳 NOT_MODIFIED；
+            失敗時回傳 None
         """
         url = f"{self.base_url}?p_career={career}"
-        career_name = self.career_mapping.get(career, career)
 
         try:
             self.logger.info("開始爬取 %s 課程資料...", career_name)
 
-            response = requests.get(url, timeout=30)
+            headers = self._conditional_headers(career, career_name)
+
+            self._throttle()
+            response = self.session.get(url, timeout=30, headers=headers)
             response.raise_for_status()  # 4xx/5xx 直接丟 RequestException (HTTPError)
 
-            cleaned_text = self._clean_json_text(response.text)
+            if response.status_code == 304:
+                # 資料未變更：略過下載內容的解析、修補與存檔
+                self.logger.info("%s 課程資料未變更", career_name)
+                if not load_cached:
+                    return NOT_MODIFIED
+                with open(self._data_path(career, career_name), "rb") as f:
+                    return _loads(f.read())
+
+            self._pending_validators[career] = {
+                "etag": response.headers.get("ETag", ""),
+                "last_modified": response.headers.get("Last-Modified", ""),
+            }
+
+            try:
+                # 多數情況回應即為合法 JSON：直接解析原始位元組，不產生解碼後的字串
+                data: Dict[str, Any] = _loads(response.content)
+                self.logger.info(
+                    "%s 課程資料爬取成功，共 %s 筆資料", career_name, len(data)
+                )
+                return data
+            except ValueError as exc:
+                # JSONDecodeError 與 UnicodeDecodeError 皆為 ValueError
+                self.logger.info(
+                    "%s 回應不是合法 JSON，改為清理修補後解析: %s", career_name, exc
+                )
+
+            cleaned_text = self._clean_json_text(response.content)
+
+            try:
+                # 多半只是夾雜控制字元或前後雜訊，清理後即可解析，不必跑修補
+                data = _loads(cleaned_text)
+                self.logger.info(
+                    "%s 課程資料清理後解析成功，共 %s 筆資料", career_name, len(data)
+                )
+                return data
+            except ValueError:
+                pass
 
             try:
                 # 進一步修補常見破損再解析
                 repaired_text = self._repair_common_corruption(cleaned_text)
-                data: Dict[str, Any] = json.loads(repaired_text)
+                data = _loads(repaired_text)
                 self.logger.info(
                     "%s 課程資料爬取成功，共 %s 筆資料", career_name, len(data)
                 )
                 return data
 
-            except json.JSONDecodeError as exc:
+            except ValueError as exc:
                 # 嘗試進階救援：只擷取最外層 { ... } 區段後再解析
                 self.logger.warning(
                     "%s 第一次解析失敗，嘗試進階救援: %s", career_name, exc
                 )
 
-                brace_match = re.search(r"\{.*\}", cleaned_text, flags=re.S)
-                if brace_match:
-                    rescue_text = brace_match.group(0)
-                    # 再次截斷到最後一個 '}'（避免結尾殘留）
-                    last_brace = rescue_text.rfind("}")
-                    if last_brace != -1:
-                        rescue_text = rescue_text[: last_brace + 1]
-
+                first_brace = cleaned_text.find(b"{")
+                last_brace = cleaned_text.rfind(b"}")
+                if first_brace != -1 and last_brace > first_brace:
+                    rescue_text = cleaned_text[first_brace : last_brace + 1]
                     try:
-                        data = json.loads(rescue_text)
+                        data = _loads(rescue_text)
                         self.logger.info(
                             "%s 課程資料救援成功，共 %s 筆資料", career_name, len(data)
                         )
                         return data
-                    except json.JSONDecodeError as exc2:
+                    except ValueError as exc2:
                         self.logger.error("%s 進階救援仍失敗: %s", career_name, exc2)
                 else:
                     self.logger.error("%s 無法找到可疑 JSON 主體以救援", career_name)
 
                 # 保存原始回應以供調試
-                self._save_raw_response(career, response.text, "failed")
+                self._save_raw_response(career, response.content, "failed")
                 return None
 
         except requests.exceptions.RequestException as exc:
             self.logger.error("%s 網路請求失敗: %s", career_name, exc)
             return None
 
+        except OSError as exc:
+            # load_cached 時讀取既有資料檔失敗
+            self.logger.error("%s 讀取既有資料失敗: %s", career_name, exc)
+            return None
+
         except (ValueError, TypeError) as exc:
             # 你的 clean/repair 或後續處理有可能丟 ValueError/TypeError（看你實作）
             self.logger.error("%s 資料處理失敗: %s", career_name, exc)
             return None
 
-    def save_course_data(self, career: str, data: Dict) -> bool:
+    def save_course_data(self, career: str, career_name: str, data: Dict) -> bool:
         """
         儲存課程資料到檔案
 
         Args:
             career: 學制代碼
+            career_name: 學制名稱
             data: 課程資料
 
         Returns:
             儲存成功回傳True，失敗回傳False
         """
-        career_name = self.career_mapping.get(career, career)
-        # 使用固定檔名，不含時間戳記
-        filename = f"{career}_{career_name}.json"
-        filepath = os.path.join(self.data_dir, filename)
+        filepath = self._data_path(career, career_name)
+        # 先寫暫存檔再替換，中斷時不會留下寫到一半的 JSON
+        tmp_path = f"{filepath}.tmp"
 
         try:
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            payload = _dumps(data, self.pretty)
+
+            # 內容與既有檔案完全相同時不重寫，資料目錄保持不變
+            if self._read_bytes(filepath) == payload:
+                self.logger.info("%s資料未變更，保留既有檔案:%s", career_name, filepath)
+                self._save_validators(career, data_changed=False)
+                return True
+
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, filepath)
 
             self.logger.info("%s資料已儲存至:%s", career_name, filepath)
+            self._save_validators(career, data_changed=True)
             return True
 
-        except (OSError, ValueError) as e:
+        except (OSError, ValueError, TypeError) as e:
+            # orjson 無法序列化時丟 JSONEncodeError (TypeError)
             self.logger.error("儲存 %s 資料失敗: %s", career_name, e)
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            return False
+
+    @staticmethod
+    def _read_bytes(path: str) -> Optional[bytes]:
+        """讀取既有檔案內容，不存在或無法讀取時回傳 None"""
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _save_validators(self, career: str, data_changed: bool) -> None:
+        """
+        存檔後記錄本次回應的 ETag / Last-Modified
+
+        Args:
+            career: 學制代碼
+            data_changed: 資料檔內容是否有變更
+        """
+        meta = self._pending_validators.pop(career, None)
+        if meta is None:
+            # 本次未經 fetch_course_data 取得驗證資訊，不動既有附屬檔
+            return
+
+        meta_path = self._meta_path(career)
+        if not data_changed and os.path.exists(meta_path):
+            # 資料未變更時不改寫附屬檔，避免伺服器每次給新 ETag 就產生無意義的 commit
+            return
+
+        try:
+            if meta and any(meta.values()):
+                with open(meta_path, "wb") as f:
+                    f.write(_dumps(meta))
+            elif os.path.exists(meta_path):
+                # 伺服器不再提供驗證資訊，移除舊紀錄避免誤用
+                os.remove(meta_path)
+        except OSError as exc:
+            # 只影響下次能否略過下載，不視為存檔失敗
+            self.logger.warning("更新 %s 失敗: %s", meta_path, exc)
+
+    def _crawl_career(self, career: str, career_name: str) -> bool:
+        """
+        爬取並儲存單一學制（於執行緒池中執行）
+
+        Args:
+            career: 學制代碼
+            career_name: 學制名稱
+
+        Returns:
+            成功（含資料未變更）回傳True，失敗回傳False
+        """
+        data = self.fetch_course_data(career, career_name, load_cached=False)
+
+        if data is NOT_MODIFIED:
+            # 資料未變更，沿用既有檔案
+            return True
+        if data is None:
             return False
 
+        # 下載完成即在同一執行緒存檔，不必等待其他學制
+        return self.save_course_data(career, career_name, data)
+
     def crawl_all_careers(self) -> Dict[str, bool]:
         """
         爬取所有學制的課程資料
@@ -228,21 +457,16 @@ class NCHUCourseCrawler:
         self.logger.info("%s", "開始執行課程資料爬取任務")
         self.logger.info("%s", "=" * 50)
 
-        # 直接迭代 dict（不呼叫 .keys()）
-        for career, career_name in self.career_mapping.items():
-            # 爬取資料
-            data = self.fetch_course_data(career)
-
-            if data is not None:
-                # 儲存資料
-                success = self.save_course_data(career, data)
-                results[career_name] = success
-            else:
-                results[career_name] = False
-
-            # 避免對伺服器造成過大負擔
-            time.sleep(2)
+        # 各學制同時爬取與存檔，整體耗時約等於最慢的一個學制
+        with ThreadPoolExecutor(max_workers=len(self.career_mapping)) as executor:
+            futures = {
+                career_name: executor.submit(self._crawl_career, career, career_name)
+                for career, career_name in self.career_mapping.items()
+            }
 
+            # 依 career_mapping 順序收集結果，摘要輸出順序固定
+            for career_name, future in futures.items():
+                results[career_name] = future.result()
 
         # 輸出結果摘要
         self._print_summary(results)